@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import queue
 import mysql.connector
 from mysql.connector import Error
 from getpass import getpass  # For secure password input
@@ -45,35 +47,77 @@ TABLE_NAME_INSTANCE = 'instance'
 # The name of the moth table in the database
 TABLE_NAME_MOTH = 'moth'
 
+# The maximum number of idle MySQL connections kept open for re-use
+# with any one database configuration
+CONNECTION_POOL_SIZE = 4
+
+# The pools of idle MySQL connections, one per database configuration,
+# each created on first use, and a lock so that threads wanting a
+# connection at the same time don't each create a pool
+CONNECTION_POOLS = {}
+CONNECTION_POOL_LOCK = threading.Lock()
+
+def ensure_credentials(db_config=None):
+    """
+    Make sure that the MySQL user name and password are known,
+    prompting for whichever is not already set or in db_config;
+    call this once at start of day so that the prompting is done
+    up-front rather than when the first connection is made.
+    """
+    global MYSQL_USER_NAME, MYSQL_PASSWORD
+    if db_config is None:
+        db_config = {}
+    if 'user' not in db_config and MYSQL_USER_NAME is None:
+        MYSQL_USER_NAME = input(f"{PREFIX}enter your MySQL username: ")
+    if 'password' not in db_config and MYSQL_PASSWORD is None:
+        MYSQL_PASSWORD = getpass(f"{PREFIX}enter your MySQL password: ")
+
 class DatabaseConnection:
     """
-    Custom context manager for database connection.
+    Custom context manager for database connection; the connection
+    is taken from a pool of idle connections for the same database
+    configuration, or opened if there is none, and given back to the
+    pool on exit, so that the connection set-up is not repeated for
+    each use.
     """
     def __init__(self, **db_config):
-        # Populate the user-name and password the first time through,
-        # if not already done
+        # Populate the user-name and password, if not already done
+        ensure_credentials(db_config)
         self.db_config = db_config
-        global MYSQL_USER_NAME, MYSQL_PASSWORD
-        if 'user' not in self.db_config and MYSQL_USER_NAME is None:
-            MYSQL_USER_NAME = input(f"{PREFIX}enter your MySQL username: ")
         if MYSQL_USER_NAME is not None:
             self.db_config['user'] = MYSQL_USER_NAME
-        if 'password' not in self.db_config and MYSQL_PASSWORD is None:
-            MYSQL_PASSWORD = getpass(f"{PREFIX}enter your MySQL password: ")
         if MYSQL_PASSWORD is not None:
             self.db_config['password'] = MYSQL_PASSWORD
+        self.pool = None
         self.connection = None
 
     def __enter__(self):
+        # Find the pool for this configuration, creating it if necessary;
+        # the lock is held only for that, so that threads opening
+        # connections don't have to wait for each other to do so
+        with CONNECTION_POOL_LOCK:
+            self.pool = CONNECTION_POOLS.setdefault(tuple(sorted(self.db_config.items())),
+                                                    queue.Queue(CONNECTION_POOL_SIZE))
         try:
-            # Establish the connection
-            self.connection = mysql.connector.connect(**self.db_config)
+            try:
+                self.connection = self.pool.get_nowait()
+                # The server may have dropped an idle connection
+                self.connection.ping(reconnect=True)
+            except queue.Empty:
+                self.connection = mysql.connector.connect(**self.db_config)
             return self.connection
         except Error as e:
-            print(f"{PREFIX}ERROR: could not connect to database ({e}).")
+            # Newline included so that the message is a single write,
+            # one that can't be split up by those of other threads
+            print(f"{PREFIX}ERROR: could not connect to database ({e}).\n", end='')
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # Ensure the connection is closed
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
\ No newline at end of file
+        # Give the connection back to the pool in a clean state, closing
+        # it instead if that can't be done or the pool is already full
+        if self.connection:
+            try:
+                self.connection.reset_session()
+                self.pool.put_nowait(self.connection)
+            except (Error, queue.Full):
+                self.connection.close()
@@ -18,13 +18,18 @@ import sys
 import os
 import argparse
 from datetime import datetime
-import requests
+import urllib3
 import re
-from urllib.parse import urljoin, urlsplit, urlunsplit
+import shutil
+import tempfile
+from html.parser import HTMLParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from pathlib import Path
 import mysql.connector
 from mysql.connector import Error
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
 
 import moths_common
 
@@ -48,22 +53,172 @@ MOTH_INDEX_FILE_NAME = 'moths'
 # web site
 IMAGE_FILE_NAME_INDEX_OFFSET = 100
 
-# Array to convert a small integer to a word
-INT_TO_WORD = ['no', 'one', 'two', 'three', 'four', 'five', 'six', 'seven',
+# The number of hosts that the HTTP pool manager keeps connection pools for
+# and the maximum number of connections kept alive in each of them
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 20
+
+# The User-Agent header sent with every HTTP request
+HTTP_USER_AGENT = 'moths_export_html'
+
+# The number of rows fetched from the database at a time
+DATABASE_FETCH_ROWS = 500
+
+# The time to wait for a web-site to respond, in seconds
+HTTP_TIMEOUT_SECONDS = 30
+
+# The number of times an HTTP request is retried, should the connection
+# fail or the web-site be temporarily unavailable, the delay between
+# retries starting at HTTP_RETRY_BACKOFF_SECONDS and doubling each time
+HTTP_RETRIES = 3
+HTTP_RETRY_BACKOFF_SECONDS = 0.3
+
+# The size of the chunks in which a file fetched from a web-site is
+# written to disk
+HTTP_COPY_CHUNK_SIZE = 64 * 1024
+
+# The directory where pristine copies of the files fetched from a
+# web-site are cached, so that they need only be fetched again if
+# they have changed
+HTTP_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'moths_export_html')
+
+# The directory where the compiled form of the Jinja2 template is
+# cached, so that it need only be compiled again if it has changed
+JINJA2_CACHE_DIR = os.path.join(HTTP_CACHE_DIR, 'jinja2')
+
+# The number of threads used to write image files to disk, which is
+# also the number of fetched images that may be waiting to be written
+IMAGE_WRITE_WORKERS = 4
+
+# Tuple to convert a small integer to a word
+INT_TO_WORD = ('no', 'one', 'two', 'three', 'four', 'five', 'six', 'seven',
                'eight', 'nine', 'ten', 'eleven', 'twelve', 'thirteen',
                'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen',
-               'nineteen','twenty', 'twenty-one', 'twenty-two', 'twenty-three',
-               'twenty-four', 'twenty-five', 'twenty-six', 'twenty-seven'
-               'twnenty-eight', 'twenty-nine', 'thirty']
+               'nineteen', 'twenty', 'twenty-one', 'twenty-two', 'twenty-three',
+               'twenty-four', 'twenty-five', 'twenty-six', 'twenty-seven',
+               'twenty-eight', 'twenty-nine', 'thirty')
+
+# The name of the file, in the HTTP_CACHE_DIR directory for the base URL,
+# in which the latest trapping directory found there is cached
+TRAPPING_LATEST_CACHE_FILE_NAME = 'trapping_latest'
+
+# Regex to match the href of a link to a directory of the form moths_DD-MM-YY
+# in the index page at the base URL: the href must begin with
+# TRAPPING_NAME_PREFIX_DD-MM-YY and end with a '/', indicating a directory
+TRAPPING_DIR_HREF_REGEX = re.compile(f'{TRAPPING_NAME_PREFIX}\\d\\d-\\d\\d-\\d\\d/')
+
+# Regex to find, in a published trapping page, "<i> Back to <a href="*">*</a> moth page"
+# so that a "Forward to" link can be inserted in front of it; the 'B' sits between
+# the two groups so that it may be replaced
+FORWARD_TO_REGEX = re.compile('(<i>\\s*)B(ack to <a\\s+href=\\s*"[^"]+"\\s*>[^<]+</a> moth page)',
+                              flags=re.MULTILINE)
 
 def date_from_path(path):
     """
     Function to get a date/time from a string that ends with "dd-mm-yy.html"
     """
-    # The negative numbers here are meant to get "30-05-24" from "blah_30-05-24.html"
-    return datetime.strptime(path[-8-5:-5], '%d-%m-%y')
+    # The negative numbers here are meant to get "30-05-24" from "blah_30-05-24.html";
+    # the integers are picked out directly rather than with strptime(), which
+    # has to parse the format string each time, with the two-digit year
+    # mapped to a century in the same way as strptime()'s '%y'
+    dmy = path[-8-5:-5]
+    if dmy[2] != '-' or dmy[5] != '-':
+        raise ValueError(f"'{path}' does not end with dd-mm-yy.html")
+    year = int(dmy[6:8])
+    year += 1900 if year >= 69 else 2000
+    return datetime(year, int(dmy[3:5]), int(dmy[0:2]))
+
+class TrappingDirParser(HTMLParser):
+    """
+    HTML parser that checks the href of each <a> tag for a link to
+    a trapping directory, keeping the latest such link in self.latest
+    and the number of them in self.count and, only if keep_all is True,
+    a list of all of them in self.matches; it may be fed the page in
+    chunks.
+    """
+    def __init__(self, keep_all=False):
+        super().__init__()
+        self.latest = None
+        self.latest_date = None
+        self.count = 0
+        self.matches = [] if keep_all else None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value and TRAPPING_DIR_HREF_REGEX.fullmatch(value):
+                    self.count += 1
+                    if self.matches is not None:
+                        self.matches.append(value)
+                    # ":-1" below to remove the "/" on the end of value
+                    date = date_from_path(value[:-1] + '.html')
+                    if self.latest_date is None or date > self.latest_date:
+                        self.latest = value
+                        self.latest_date = date
+
+def http_session():
+    """
+    Create a urllib3 pool manager which keeps HTTP connections alive
+    between requests, so that fetching several things from the same
+    web-site only pays for the TCP/TLS set-up once; transient
+    failures are retried.
+    """
+    # raise_on_status=False so that, should the retries run out on a
+    # bad status, the last response is returned for the caller to report
+    retries = urllib3.Retry(total=HTTP_RETRIES,
+                            backoff_factor=HTTP_RETRY_BACKOFF_SECONDS,
+                            status_forcelist=(502, 503, 504),
+                            raise_on_status=False)
+    return urllib3.PoolManager(num_pools=HTTP_POOL_CONNECTIONS,
+                               maxsize=HTTP_POOL_MAXSIZE,
+                               headers={'User-Agent': HTTP_USER_AGENT},
+                               timeout=HTTP_TIMEOUT_SECONDS,
+                               retries=retries)
+
+def http_cache_headers(cache_file_path):
+    """
+    Return the headers that make a GET request conditional on the
+    thing fetched having changed since it was cached in cache_file_path,
+    an empty dictionary if there is nothing cached.  Only validators
+    that came from the server are used: in particular, the time the
+    cached copy was written locally is no guide to whether the server's
+    copy has changed since.
+    """
+    headers = {}
+    if cache_file_path.is_file():
+        last_modified_file_path = cache_file_path.with_name(cache_file_path.name + '.last_modified')
+        if last_modified_file_path.is_file():
+            headers['If-Modified-Since'] = last_modified_file_path.read_text()
+        etag_file_path = cache_file_path.with_name(cache_file_path.name + '.etag')
+        if etag_file_path.is_file():
+            headers['If-None-Match'] = etag_file_path.read_text()
+    return headers
+
+def http_cache_validators_save(response, cache_file_path):
+    """
+    Having written cache_file_path from response, remember the server's
+    Last-Modified time, ready for If-Modified-Since next time, and its
+    ETag, ready for If-None-Match, forgetting any that the server
+    did not send this time.
+    """
+    for header, suffix in (('Last-Modified', '.last_modified'), ('ETag', '.etag')):
+        validator_file_path = cache_file_path.with_name(cache_file_path.name + suffix)
+        validator = response.headers.get(header)
+        if validator:
+            validator_file_path.write_text(validator)
+        else:
+            validator_file_path.unlink(missing_ok=True)
+
+def http_cache_discard(cache_file_path):
+    """
+    Remove cache_file_path and its validators, so that the next
+    GET is not made conditional on a copy that can't be trusted.
+    """
+    cache_file_path.unlink(missing_ok=True)
+    for suffix in ('.last_modified', '.etag'):
+        cache_file_path.with_name(cache_file_path.name + suffix).unlink(missing_ok=True)
 
-def url_trapping_latest(base_url, verbose=False):
+def url_trapping_latest(session, base_url, verbose=False):
     """
     Check base_url to find all of the moth trappings at it
     and return the URL of the latest one.  Directories
@@ -71,63 +226,152 @@ def url_trapping_latest(base_url, verbose=False):
     and contain a HTML page of the same name.
     """
     last_published_file_path = None
+    latest = None
     if verbose:
         print((f"{moths_common.PREFIX}searching '{base_url}' for directories"
                f" of the pattern '{TRAPPING_NAME_PREFIX}DD-MM-YY/'..."))
 
+    # The latest directory found last time is cached, so that the request
+    # for the index page can be a conditional one and, if the page has not
+    # changed, it need not be downloaded and parsed again
+    split_url = urlsplit(base_url)
+    cache_file_path = Path(HTTP_CACHE_DIR, split_url.netloc, split_url.path.lstrip('/'),
+                           TRAPPING_LATEST_CACHE_FILE_NAME)
+
     # Send a GET request to the URL
-    response = requests.get(base_url)
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Find all the directory links of the form moths_DD-MM-YY
-        # This pattern looks for <a> tags with href attributes that begin
-        # with TRAPPING_NAME_PREFIX_DD-MM-YY and end with a '/', indicating
-        # a directory
-        pattern = re.compile(f'<a\\s+(?:[^>]*?\\s+)?href=\\s*"({TRAPPING_NAME_PREFIX}\\d\\d-\\d\\d-\\d\\d/)"')
-        matches = pattern.findall(response.text)
+    parser = None
+    response = session.request('GET', base_url,
+                               headers={**session.headers, **http_cache_headers(cache_file_path)},
+                               preload_content=False)
+    try:
+        # Check if the request was successful
+        if response.status == 304:
+            latest = cache_file_path.read_text()
+            if verbose:
+                print((f"{moths_common.PREFIX}'{base_url}' is unchanged, using the"
+                       " cached latest directory."))
+        elif response.status == 200:
+            # Look at all the directory links of the form moths_DD-MM-YY,
+            # parsing the page as it arrives rather than decoding all
+            # of it into one string first; only the one with the latest
+            # DD-MM-YY is needed, so the parser keeps track of that as it
+            # goes, only keeping a list of all of them if we are to print it.
+            # The links of interest are pure ASCII, hence a single-byte
+            # decode is sufficient whatever the character set of the page
+            parser = TrappingDirParser(keep_all=verbose)
+            for data in response.stream(HTTP_COPY_CHUNK_SIZE):
+                parser.feed(data.decode('latin-1'))
+            parser.close()
+            latest = parser.latest
+        else:
+            print((f"{moths_common.PREFIX}ERROR: failed to retrieve page ({response.status})."))
+    finally:
+        # Give the connection back to the pool for re-use
+        response.drain_conn()
+        response.release_conn()
+
+    if parser is not None:
         if verbose:
-            print(f"{moths_common.PREFIX}found {len(matches)} directories:")
-            for match in matches:
+            print(f"{moths_common.PREFIX}found {parser.count} directories:")
+            for match in parser.matches:
                 print((f"{moths_common.PREFIX}  '{match}'"))
-        # Construct full URLs for the directories and the HTML pages they should contain
-        # ":-1" below to remove the "/" on the end of match
-        files = [urljoin(base_url, match + match[:-1] + '.html') for match in matches]
-        # Sort the list in order of DD-MM-YY
-        files.sort(key=date_from_path)
-        if len(files) > 0:
-            last_published_file_path = files[len(files) - 1]
-            print((f"{moths_common.PREFIX}latest trapping page at '{base_url}' is"
-                   f" '{last_published_file_path[len(base_url):]}'."))
-        else:
-            if verbose:
-                print((f"{moths_common.PREFIX} found no directories macthing the pattern"
-                       f" '{TRAPPING_NAME_PREFIX}DD-MM-YY'."))
-    else:
-        print((f"{moths_common.PREFIX}ERROR: failed to retrieve page ({response.status_code})."))
+        if latest:
+            # Remember the latest directory for next time
+            cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_file_path.write_text(latest)
+            http_cache_validators_save(response, cache_file_path)
+        elif cache_file_path.is_file():
+            cache_file_path.unlink()
+    if latest:
+        # Construct the full URL for the HTML page the directory should contain,
+        # ":-1" below to remove the "/" on the end of the directory; base_url
+        # ends with a '/' so this is a simple concatenation
+        last_published_file_path = f"{base_url}{latest}{latest[:-1]}.html"
+        print((f"{moths_common.PREFIX}latest trapping page at '{base_url}' is"
+               f" '{last_published_file_path[len(base_url):]}'."))
+    elif parser is not None:
+        if verbose:
+            print((f"{moths_common.PREFIX} found no directories macthing the pattern"
+                   f" '{TRAPPING_NAME_PREFIX}DD-MM-YY'."))
 
     return last_published_file_path
 
-def url_copy_local(base_dir, base_url, url, verbose=False):
+def url_copy_local(session, base_dir, base_url, url, verbose=False):
     """
-    Fetch a url to a local file, returning the file path.
+    Fetch a url to a local file, returning the file path.  A pristine
+    copy of what was fetched is kept in HTTP_CACHE_DIR, along with its
+    ETag, so that the next fetch of the same url can be a conditional
+    one, the body only being transferred if it has changed.
     """
     file_path = None
     local_file_path = os.path.join(base_dir, url[len(base_url):])
     if verbose:
         print((f"{moths_common.PREFIX}fetching '{url}' to '{local_file_path}'."))
-        
-    response = requests.get(url)
-    if response.status_code == 200:
+
+    # The cached copy is kept separately from local_file_path since the
+    # latter is going to be modified
+    split_url = urlsplit(url)
+    cache_file_path = Path(HTTP_CACHE_DIR, split_url.netloc, split_url.path.lstrip('/'))
+
+    # Stream the body straight to disk rather than holding all of it in memory
+    response = None
+    try:
+        response = session.request('GET', url,
+                                   headers={**session.headers, **http_cache_headers(cache_file_path)},
+                                   preload_content=False)
+        if response.status == 200:
+            # The cached copy is out of date: get rid of it first, so that
+            # it is gone even if we are stopped part way through the download
+            http_cache_discard(cache_file_path)
+            # Make sure the directories exist
+            cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+            # Download to a temporary file alongside the cached copy and only
+            # move it into place once the whole body has arrived, so that a
+            # truncated download is never taken for a good cached copy;
+            # any Content-Encoding (e.g. gzip) is undone on the way through
+            file = tempfile.NamedTemporaryFile(dir=cache_file_path.parent,
+                                               prefix=f".{cache_file_path.name}.",
+                                               suffix='.part', delete=False)
+            try:
+                with file:
+                    shutil.copyfileobj(response, file, length=HTTP_COPY_CHUNK_SIZE)
+                os.replace(file.name, cache_file_path)
+            except BaseException:
+                os.unlink(file.name)
+                raise
+            http_cache_validators_save(response, cache_file_path)
+        elif response.status == 304 and cache_file_path.is_file():
+            if verbose:
+                print((f"{moths_common.PREFIX}'{url}' is unchanged, using the cached copy."))
+        else:
+            http_cache_discard(cache_file_path)
+            cache_file_path = None
+            print((f"{moths_common.PREFIX}ERROR: failed to retrieve '{url}' ({response.status})."))
+    except BaseException:
+        http_cache_discard(cache_file_path)
+        raise
+    finally:
+        if response is not None:
+            # Give the connection back to the pool for re-use
+            response.drain_conn()
+            response.release_conn()
+    if cache_file_path:
         file_path = Path(local_file_path)
         # Make sure the directories exist
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        with file_path.open(mode='wb') as file:
-            file.write(response.content)
-    else:
-        print((f"{moths_common.PREFIX}ERROR: failed to retrieve '{url}' ({response.status_code})."))
+        shutil.copyfile(cache_file_path, file_path)
     return file_path
 
+def cursor_rows(cursor):
+    """
+    Generator that yields the rows resulting from the last query
+    executed on cursor, fetching them cursor.arraysize at a time.
+    """
+    rows = cursor.fetchmany()
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany()
+
 def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
     """
     Get the data required for the HTML page for trappings that are present in the
@@ -137,91 +381,138 @@ def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
     trapping_list = []
     try:
         with moths_common.DatabaseConnection(**db_config) as connection:
-            cursor = connection.cursor()
-            # This will get us back a dictionary rather than a list
-            cursor = connection.cursor(dictionary=True)
-
-            # First, a query to obtain a dictionary of trappings after the given date
+            # This will get us back a dictionary rather than a list; not
+            # buffered, so that rows are read from the server as they are
+            # consumed, rather than the whole result set being held in
+            # memory, which is fine since each result set is read to the
+            # end before the next query is executed
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            # Read and convert rows in batches of this size
+            cursor.arraysize = DATABASE_FETCH_ROWS
+
+            # A single query that returns a row for each instance, in each trapping
+            # after the given date, that has an image attached or a count > 0, along
+            # with the moth for that instance; the images themselves are not
+            # fetched here, they are large and not all of them will be used, see
+            # instance_images_db_write() for that.  A trapping with no such instances
+            # still returns a single row, with NULL instance and moth fields.  Rows
+            # are ordered by trapping, then moth, then instance, so that they can be
+            # grouped back into the nested structure in one pass; the trappings are
+            # in ascending date order since that is the order in which they are
+            # chained together when published, each pointing back to the one before
             query = f"""
             SELECT
               {moths_common.TABLE_NAME_TRAPPING}.id AS trapping_id,
               {moths_common.TABLE_NAME_TRAPPING}.date,
-              {moths_common.TABLE_NAME_TRAPPING}.description
+              {moths_common.TABLE_NAME_TRAPPING}.description,
+              {moths_common.TABLE_NAME_MOTH}.id AS moth_id,
+              {moths_common.TABLE_NAME_MOTH}.common_name,
+              {moths_common.TABLE_NAME_MOTH}.scientific_name,
+              {moths_common.TABLE_NAME_MOTH}.html_name,
+              {moths_common.TABLE_NAME_MOTH}.html_best_instance_id,
+              {moths_common.TABLE_NAME_MOTH}.html_best_url,
+              {moths_common.TABLE_NAME_INSTANCE}.id AS instance_id,
+              {moths_common.TABLE_NAME_INSTANCE}.count,
+              {moths_common.TABLE_NAME_INSTANCE}.variant,
+              LENGTH({moths_common.TABLE_NAME_INSTANCE}.image) > 0 AS has_image,
+              {moths_common.TABLE_NAME_INSTANCE}.html_use_image,
+              {moths_common.TABLE_NAME_INSTANCE}.html_description
             FROM {moths_common.TABLE_NAME_TRAPPING}
+            LEFT JOIN {moths_common.TABLE_NAME_INSTANCE} ON {moths_common.TABLE_NAME_INSTANCE}.trapping_id = {moths_common.TABLE_NAME_TRAPPING}.id AND
+                      {moths_common.TABLE_NAME_INSTANCE}.moth_id IS NOT NULL AND
+                      (({moths_common.TABLE_NAME_INSTANCE}.html_use_image AND {moths_common.TABLE_NAME_INSTANCE}.image IS NOT NULL) OR {moths_common.TABLE_NAME_INSTANCE}.count > 0)
+            LEFT JOIN {moths_common.TABLE_NAME_MOTH} ON {moths_common.TABLE_NAME_INSTANCE}.moth_id = {moths_common.TABLE_NAME_MOTH}.id
             WHERE {moths_common.TABLE_NAME_TRAPPING}.date > %s
-            ORDER BY {moths_common.TABLE_NAME_TRAPPING}.date DESC;
+            ORDER BY {moths_common.TABLE_NAME_TRAPPING}.date, {moths_common.TABLE_NAME_TRAPPING}.id, {moths_common.TABLE_NAME_MOTH}.id, {moths_common.TABLE_NAME_INSTANCE}.id;
             """
             cursor.execute(query, (date_from,))
 
-            # Fetch the result
-            trapping_list = cursor.fetchall()
+            # Group the rows back into a list of trappings, each with a list
+            # of moths, each of which has a total count and a list of the
+            # instances that have an image attached
+            trapping = None
+            moth = None
+            instance_count = {}
+            for row in cursor_rows(cursor):
+                if trapping is None or trapping['trapping_id'] != row['trapping_id']:
+                    trapping = {'trapping_id': row['trapping_id'],
+                                'date': row['date'],
+                                'description': row['description'],
+                                'moth_list': []}
+                    trapping_list.append(trapping)
+                    instance_count[trapping['trapping_id']] = 0
+                    moth = None
+                if row['moth_id'] is None:
+                    # A trapping with no instances of interest
+                    continue
+                if moth is None or moth['moth_id'] != row['moth_id']:
+                    moth = {'moth_id': row['moth_id'],
+                            'common_name': row['common_name'],
+                            'scientific_name': row['scientific_name'],
+                            'html_name': row['html_name'],
+                            'html_best_instance_id': row['html_best_instance_id'],
+                            'html_best_url': row['html_best_url'],
+                            'count': 0,
+                            'image_list': []}
+                    trapping['moth_list'].append(moth)
+                # Total up the counts to add that at the top level, and
+                # add the instances that have an image attached to that
+                # moth's image list
+                moth['count'] += row['count']
+                if row['has_image'] and row['html_use_image']:
+                    moth['image_list'].append({'instance_id': row['instance_id'],
+                                               'count': row['count'],
+                                               'variant': row['variant'],
+                                               'html_use_image': row['html_use_image'],
+                                               'html_description': row['html_description']})
+                instance_count[trapping['trapping_id']] += 1
+
             print(f"{moths_common.PREFIX}{len(trapping_list)} trapping(s) in database"
                   f" after {date_from.strftime('%Y-%m-%d')}.")
-            success = True
-            for trapping in trapping_list:
-                # Next, a query to obtain the moths for the instances in each
-                # trapping that have an image attached or a count > 0
+
+            # Collect the 'html_best_instance_id' of every moth that does not
+            # have a 'html_best_url', then fetch the instance and moth data
+            # required to compute that URL for all of them in a single query,
+            # a dictionary keyed on instance ID
+            best_instance_id_set = {moth['html_best_instance_id']
+                                    for trapping in trapping_list
+                                    for moth in trapping['moth_list']
+                                    if not moth['html_best_url'] and moth['html_best_instance_id']}
+            best_instance_dict = {}
+            if len(best_instance_id_set) > 0:
                 query = f"""
-                SELECT DISTINCT
-                  {moths_common.TABLE_NAME_MOTH}.id AS moth_id,
-                  {moths_common.TABLE_NAME_MOTH}.common_name,
-                  {moths_common.TABLE_NAME_MOTH}.scientific_name,
+                SELECT
+                  {moths_common.TABLE_NAME_INSTANCE}.id AS instance_id,
+                  {moths_common.TABLE_NAME_INSTANCE}.trapping_id,
+                  LENGTH({moths_common.TABLE_NAME_INSTANCE}.image) > 0 AS has_image,
+                  {moths_common.TABLE_NAME_INSTANCE}.html_use_image,
+                  {moths_common.TABLE_NAME_MOTH}.id as moth_id,
                   {moths_common.TABLE_NAME_MOTH}.html_name,
-                  {moths_common.TABLE_NAME_MOTH}.html_best_instance_id,
-                  {moths_common.TABLE_NAME_MOTH}.html_best_url,
-                  {moths_common.TABLE_NAME_TRAPPING}.date -- required in order to use a DISTINCT SELECT
+                  {moths_common.TABLE_NAME_TRAPPING}.date
                 FROM {moths_common.TABLE_NAME_INSTANCE}
-                JOIN {moths_common.TABLE_NAME_TRAPPING} ON {moths_common.TABLE_NAME_INSTANCE}.trapping_id = {moths_common.TABLE_NAME_TRAPPING}.id
                 JOIN {moths_common.TABLE_NAME_MOTH} ON {moths_common.TABLE_NAME_INSTANCE}.moth_id = {moths_common.TABLE_NAME_MOTH}.id
-                WHERE {moths_common.TABLE_NAME_TRAPPING}.date = %s AND
-                      (({moths_common.TABLE_NAME_INSTANCE}.html_use_image AND {moths_common.TABLE_NAME_INSTANCE}.image IS NOT NULL) OR {moths_common.TABLE_NAME_INSTANCE}.count > 0)
+                JOIN {moths_common.TABLE_NAME_TRAPPING} ON {moths_common.TABLE_NAME_INSTANCE}.trapping_id = {moths_common.TABLE_NAME_TRAPPING}.id
+                WHERE {moths_common.TABLE_NAME_INSTANCE}.id IN ({', '.join(['%s'] * len(best_instance_id_set))})
                 """
-                cursor.execute(query, (trapping['date'],))
-                # Fetch the result
-                trapping['moth_list'] = cursor.fetchall()
+                cursor.execute(query, tuple(best_instance_id_set))
+                best_instance_dict = {row['instance_id']: row for row in cursor_rows(cursor)}
+            # All of the data is now in hand, no further need of the cursor
+            cursor.close()
 
-                # Now, to each moth, attach the instances
-                # that have an image attached or a count > 0
-                instance_count = 0
+            success = True
+            for trapping in trapping_list:
                 for moth in trapping['moth_list']:
-                    query = f"""
-                    SELECT
-                      {moths_common.TABLE_NAME_INSTANCE}.id AS instance_id,
-                      {moths_common.TABLE_NAME_INSTANCE}.count,
-                      {moths_common.TABLE_NAME_INSTANCE}.variant,
-                      {moths_common.TABLE_NAME_INSTANCE}.image,
-                      {moths_common.TABLE_NAME_INSTANCE}.html_use_image,
-                      {moths_common.TABLE_NAME_INSTANCE}.html_description
-                    FROM {moths_common.TABLE_NAME_INSTANCE}
-                    JOIN {moths_common.TABLE_NAME_TRAPPING} ON {moths_common.TABLE_NAME_INSTANCE}.trapping_id = {moths_common.TABLE_NAME_TRAPPING}.id
-                    JOIN {moths_common.TABLE_NAME_MOTH} ON {moths_common.TABLE_NAME_INSTANCE}.moth_id = {moths_common.TABLE_NAME_MOTH}.id
-                    WHERE {moths_common.TABLE_NAME_TRAPPING}.date = %s AND {moths_common.TABLE_NAME_INSTANCE}.moth_id = %s AND
-                          (({moths_common.TABLE_NAME_INSTANCE}.html_use_image AND {moths_common.TABLE_NAME_INSTANCE}.image IS NOT NULL) OR {moths_common.TABLE_NAME_INSTANCE}.count > 0)
-                    """
-                    cursor.execute(query, (trapping['date'], moth['moth_id']))
-                    # Fetch the result
-                    instance_list = cursor.fetchall()
-                    # Go through the list, totalling up the counts to add
-                    # that at the top level, and adding the instances that
-                    # have an image attached to that moth's image list
-                    moth['image_list'] = []
-                    count = 0
-                    for instance in instance_list:
-                        count += instance['count']
-                        if instance['image'] and instance['html_use_image']:
-                            moth['image_list'].append(instance)
-                        instance_count += 1
-                    moth['count'] = count
                     # Sort the image list so that, if there is an instance_id
                     # which matches that moth's html_best_instance_id, it is
                     # first in the list: this way it will be the one that is
                     # labelled in the HTML output
-                    if 'html_best_instance_id' in moth:
+                    if moth['html_best_instance_id']:
                         moth['image_list'].sort(key=lambda x: -(x['instance_id'] == moth['html_best_instance_id']))
 
                 if verbose:
                     print(f"{moths_common.PREFIX}trapping on {trapping['date'].strftime('%Y-%m-%d')}"
-                          f" had {instance_count} instance(s), {len(trapping['moth_list'])} type(s) of moth.")
+                          f" had {instance_count[trapping['trapping_id']]} instance(s),"
+                          f" {len(trapping['moth_list'])} type(s) of moth.")
                 for instance in trapping['moth_list']:
                     # If 'html_name' is empty, generate a name from 'common_name'
                     if not instance['html_name']:
@@ -231,7 +522,8 @@ def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
                     # In cases where there is a 'html_best_url' it will be that, otherwise
                     # if 'html_best_instance_id' has been populated we can work out what the
                     # 'html_best_url' would be from that, in the form
-                    # 'base_url + moths_DD-MM-YY/moths_DD-MM-YY.html#html_name'.
+                    # 'base_url + moths_DD-MM-YY/moths_DD-MM-YY.html#html_name', where
+                    # DD-MM-YY is the date of the trapping of 'html_best_instance_id'.
                     # Alternatively, if the 'trapping_id' for the 'html_best_instance_id'
                     # is this 'trapping_id' then there _is_ no previous photo, this is our first.
                     if instance['html_best_url']:
@@ -242,34 +534,25 @@ def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
                                 print((f"{moths_common.PREFIX}moth ID {instance['moth_id']}"
                                        f" ('{instance['common_name']}') does not have a 'html_best_url',"
                                         " computing one..."))
-                            # This query should return a single row combining the required instance
-                            # and moth data for the instance ID that is 'html_best_instance_id'
-                            query = f"""
-                            SELECT
-                              {moths_common.TABLE_NAME_INSTANCE}.id AS instance_id,
-                              {moths_common.TABLE_NAME_INSTANCE}.trapping_id,
-                              {moths_common.TABLE_NAME_INSTANCE}.image,
-                              {moths_common.TABLE_NAME_INSTANCE}.html_use_image,
-                              {moths_common.TABLE_NAME_MOTH}.id as moth_id,
-                              {moths_common.TABLE_NAME_MOTH}.html_name
-                            FROM {moths_common.TABLE_NAME_INSTANCE}
-                            JOIN {moths_common.TABLE_NAME_MOTH} ON {moths_common.TABLE_NAME_INSTANCE}.moth_id = {moths_common.TABLE_NAME_MOTH}.id
-                            WHERE {moths_common.TABLE_NAME_INSTANCE}.id = %s
-                            """
-                            cursor.execute(query, (instance['html_best_instance_id'],))
-                            best_url_computed = cursor.fetchall()
-                            if best_url_computed and len(best_url_computed) == 1:
-                                if best_url_computed[0]['image'] and \
-                                   best_url_computed[0]['html_use_image'] and \
-                                   best_url_computed[0]['html_name']:
-                                    if trapping['trapping_id'] != best_url_computed[0]['trapping_id']:
-                                        prefix_str = TRAPPING_NAME_PREFIX + trapping['date'].strftime('%d-%m-%y')
-                                        instance['html_previous_image'] = urljoin('../', prefix_str + '/' + \
-                                                                                  prefix_str + '.html#' + \
-                                                                                  best_url_computed[0]['html_name']) 
+                            # The combined instance and moth data for the instance ID
+                            # that is 'html_best_instance_id'
+                            best_instance = best_instance_dict.get(instance['html_best_instance_id'])
+                            if best_instance:
+                                if best_instance['has_image'] and \
+                                   best_instance['html_use_image'] and \
+                                   best_instance['html_name']:
+                                    if trapping['trapping_id'] != best_instance['trapping_id']:
+                                        # The same best instance is likely to be pointed-to from
+                                        # many trappings, so only compute its URL the once
+                                        if 'html_url' not in best_instance:
+                                            prefix_str = TRAPPING_NAME_PREFIX + best_instance['date'].strftime('%d-%m-%y')
+                                            best_instance['html_url'] = '../' + prefix_str + '/' + \
+                                                                        prefix_str + '.html#' + \
+                                                                        best_instance['html_name']
+                                        instance['html_previous_image'] = best_instance['html_url']
                                         if verbose:
                                             print(f"{moths_common.PREFIX}\"best url\" for moth ID {instance['moth_id']}"
-                                                  f" ('{instance['common_name']}') is '{instance['html_best_url_computed']}').")
+                                                  f" ('{instance['common_name']}') is '{instance['html_previous_image']}').")
                                     else:
                                         if verbose:
                                             print((f"{moths_common.PREFIX}moth ID {instance['moth_id']}"
@@ -285,7 +568,7 @@ def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
                                 success = False
                                 print((f"{moths_common.PREFIX}ERROR, could find not find 'html_best_instance_id'"
                                        f" ({instance['html_best_instance_id']}) for moth ID {instance['moth_id']}"
-                                       f" ('{instance['common_name']}'), or found more than one."))
+                                       f" ('{instance['common_name']}')."))
                         else:
                             success = False
                             print((f"{moths_common.PREFIX}ERROR, moth ID {instance['moth_id']}"
@@ -301,13 +584,90 @@ def trappings_db_get_data(base_url, date_from, db_config, verbose=False):
         print(f"{moths_common.PREFIX}ERROR retrieving data: {e}.")
     return trapping_list
 
+def instance_images_db_write(db_config, file_path_dict, verbose=False):
+    """
+    Write the images of the instances whose IDs are the keys of file_path_dict
+    to the file paths that are the values, fetching all of them from the
+    database in a single query, returning the number of images written or
+    negative error code.
+    """
+    return_value = -1
+    try:
+        with moths_common.DatabaseConnection(**db_config) as connection:
+            # Not buffered, so that rows are read from the server one at a
+            # time rather than all of the images being held in memory
+            cursor = connection.cursor()
+            return_value = 0
+            query = f"""
+            SELECT
+              {moths_common.TABLE_NAME_INSTANCE}.id,
+              {moths_common.TABLE_NAME_INSTANCE}.image
+            FROM {moths_common.TABLE_NAME_INSTANCE}
+            WHERE {moths_common.TABLE_NAME_INSTANCE}.id IN ({', '.join(['%s'] * len(file_path_dict))})
+            """
+            cursor.execute(query, tuple(file_path_dict.keys()))
+            try:
+                # Hand each image to a thread to be written to disk so that
+                # the writing overlaps with fetching the next image, waiting
+                # for the oldest write once IMAGE_WRITE_WORKERS are outstanding
+                # so that, should the writing fall behind, the images waiting
+                # to be written do not pile up in memory
+                with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as executor:
+                    futures = deque()
+                    row = cursor.fetchone()
+                    while row or futures:
+                        if row:
+                            instance_id, image = row
+                            futures.append((executor.submit(file_path_dict[instance_id].write_bytes,
+                                                            image), instance_id))
+                            row = cursor.fetchone()
+                        if len(futures) > IMAGE_WRITE_WORKERS or (futures and not row):
+                            future, instance_id = futures.popleft()
+                            # This will raise any exception from the write
+                            future.result()
+                            if verbose:
+                                print((f"{moths_common.PREFIX}written image of instance ID {instance_id}"
+                                       f" to '{file_path_dict[instance_id]}'."))
+                            return_value += 1
+            finally:
+                # Should we have stopped early, e.g. because a write failed,
+                # the rest of the result set must be read before the
+                # connection can be used again or given back to the pool
+                connection.consume_results()
+                cursor.close()
+            if return_value != len(file_path_dict):
+                print((f"{moths_common.PREFIX}ERROR: only {return_value} of {len(file_path_dict)}"
+                        " image(s) found in database."))
+                return_value = -1
+    except (Error, OSError) as e:
+        print((f"{moths_common.PREFIX}ERROR retrieving or writing images: '{e}', only {max(return_value, 0)}"
+               f" of {len(file_path_dict)} image(s) written."))
+        return_value = -1
+    return return_value
+
 def trappings_publish(base_dir, base_url, site_name, last_published_file_path,
-                      trapping_list, jinja2_env, verbose=False):
+                      trapping_list, db_config, jinja2_env, verbose=False):
     """
     Publish trapping_list as HTML pages and modify last_published_file_path to include
     the new trappings in the navigation list, returning the number of pages created.
     """
 
+    # First, work out the unique name of each image that is to be used and
+    # write all of them, from the database, into the directory of their trapping
+    file_path_dict = {}
+    for trapping in trapping_list:
+        # The directory for this trapping: moths_DD-MM-YY
+        dir_path = Path(base_dir) / (TRAPPING_NAME_PREFIX + trapping['date'].strftime('%d-%m-%y'))
+        # Make sure the directory exists
+        dir_path.mkdir(parents=True, exist_ok=True)
+        for instance in trapping['moth_list']:
+            html_name_lower = instance['html_name'].lower()
+            for image in instance['image_list']:
+                image['file_name'] = f"{html_name_lower}_{image['instance_id'] + IMAGE_FILE_NAME_INDEX_OFFSET}.jpg"
+                file_path_dict[image['instance_id']] = dir_path / image['file_name']
+    if len(file_path_dict) > 0 and instance_images_db_write(db_config, file_path_dict, verbose) < 0:
+        return 0
+
     # Load the template HTML file
     template = jinja2_env.get_template('moths.html')
 
@@ -322,52 +682,52 @@ def trappings_publish(base_dir, base_url, site_name, last_published_file_path,
     # HTML page, is assumed to be at the root of the base URL, file 'index.html', and
     # is a relative path
     split_url = urlsplit(base_url)
-    dot_dot_count = split_url.path.count('/')
-    context['url_site_index'] = ''
-    for x in range(dot_dot_count):
-        context['url_site_index'] += '../'
-    context['url_site_index'] += 'index.html'
+    context['url_site_index'] = '../' * split_url.path.count('/') + 'index.html'
     context['site_name'] = site_name
     file_path_previous = last_published_file_path
+    # The contents of the previous file: read from disk for the last published
+    # file, thereafter carried forward from the page just rendered so that each
+    # page is written only once, after its "Forward to" link has been added
+    file_contents_previous = None
     # The date of the previous trapping from the web-site
     date_previous = date_from_path(str(file_path_previous))
+    date_previous_dmy = date_previous.strftime('%d-%m-%y') # 01-06-25
+    date_previous_long = date_previous.strftime('%e %B %Y').strip() # 1 June 2025
     # Run through the list populating the other context variables and writing the files
     for trapping in trapping_list:
         date_this_dmy = trapping['date'].strftime('%d-%m-%y') # 01-06-25
         date_this_long = trapping['date'].strftime('%e %B %Y').strip() # 1 June 2025
+        # The name of both the directory and the file for this trapping: moths_DD-MM-YY
+        file_and_dir_name = TRAPPING_NAME_PREFIX + date_this_dmy
 
         # Update the "Forward to" section of the last published file path to point
         # to this one
         if file_path_previous:
-            with open(str(file_path_previous), 'r') as file:
-                file_contents = file.read()
-            name = TRAPPING_NAME_PREFIX + date_this_dmy
-            forward_to = f"Forward to <a href=\"{'../' + name + '/' + name + '.html'}\">{date_this_long}</a> moth page, b"
+            if file_contents_previous is None:
+                file_contents_previous = Path(file_path_previous).read_text()
+            forward_to = (f"Forward to <a href=\"../{file_and_dir_name}/{file_and_dir_name}.html\">"
+                          f"{date_this_long}</a> moth page, b")
             # This regex looks for "<i> Back to <a href="*">*</a> moth page" and changes
             # it to "<i> Forward to <a href="blah">blah</a> moth page, back to...".
             # In implementation terms, it replaces the 'B' with the value of 'forward_to'.
-            file_contents = re.sub('(<i>\\s*)B(ack to <a\\s+href=\\s*"[^"]+"\\s*>[^<]+</a> moth page)',
-                                   f'\\1{forward_to}\\2',
-                                   file_contents, count=1, flags=re.MULTILINE)
-            with open(file_path_previous, 'w') as file:
-                file.write(file_contents)
+            file_contents_previous = FORWARD_TO_REGEX.sub(f'\\1{forward_to}\\2',
+                                                          file_contents_previous, count=1)
+            Path(file_path_previous).write_text(file_contents_previous)
 
-        # The name of both the directory and the file for this trapping: moths_DD-MM-YY
-        file_and_dir_name = f"{TRAPPING_NAME_PREFIX}{trapping['date'].strftime('%d-%m-%y')}"
-        dir = os.path.join(base_dir, file_and_dir_name)
-        file_path = Path(os.path.join(dir, file_and_dir_name) + '.html')
-        # Make sure the directories exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # The directory, created above, and the HTML file for this trapping
+        dir_path = Path(base_dir) / file_and_dir_name
+        file_path = dir_path / (file_and_dir_name + '.html')
 
         # Populate the trapping-specific context variables
         context['date_this_long'] = date_this_long
-        context['date_previous_dmy'] = date_previous.strftime('%d-%m-%y') # 01-06-25
-        context['date_previous_long'] = date_previous.strftime('%e %B %Y').strip() # 1 June 2025
+        context['date_previous_dmy'] = date_previous_dmy
+        context['date_previous_long'] = date_previous_long
         context['description_trapping'] = trapping['description']
         context['bullet_list'] = []
         context['reference_list'] = []
         context['image_list'] = []
-        bullet_list = []
+        # The html_names that already have a bullet
+        bullet_set = set()
         for instance in trapping['moth_list']:
             object = {}
             object['common_name'] = instance['common_name']
@@ -381,37 +741,41 @@ def trappings_publish(base_dir, base_url, site_name, last_published_file_path,
                 object['previous_image'] = instance['html_previous_image']
             if len(instance['image_list']) > 0:
                 for image in instance['image_list']:
-                    # Have an image: make a unique name for it, write the
-                    # file and add it to the 'image_list' of the context
-                    image_file_name = instance['html_name'].lower() + '_' + str(image['instance_id'] + IMAGE_FILE_NAME_INDEX_OFFSET) + '.jpg'
-                    with open(os.path.join(base_dir, file_and_dir_name, image_file_name), 'wb') as file:
-                        file.write(image['image'])
-                    object['file_name'] = image_file_name
-                    object['description'] = image['html_description']
-                    object['image'] = image_file_name
-                    object['label'] = False
-                    if object['html_name'] not in bullet_list:
-                        object['label'] = True
-                        context['bullet_list'].append(object.copy())
-                        # Update the bullet list
-                        bullet_list.append(object['html_name'])
-                    context['image_list'].append(object.copy())
+                    # Have an image, already written to file: add it
+                    # to the 'image_list' of the context, as a new
+                    # object based on the moth-specific fields above
+                    image_object = dict(object,
+                                        file_name=image['file_name'],
+                                        description=image['html_description'],
+                                        image=image['file_name'],
+                                        label=False)
+                    if object['html_name'] not in bullet_set:
+                        image_object['label'] = True
+                        context['bullet_list'].append(image_object)
+                        # Update the bullet set
+                        bullet_set.add(object['html_name'])
+                    context['image_list'].append(image_object)
             else:
                 # Either don't have an image or don't want to use it,
                 # add it to the 'reference_list' of the context
-                context['reference_list'].append(object.copy())
+                context['reference_list'].append(object)
 
-        # Write the rendered HTML file
-        with open(file_path, 'w') as file:
-            file.write(template.render(context))
-        print(f"{moths_common.PREFIX}CREATED new directory '{dir}' and populated it with all"
+        # Render the HTML file, which is written once the "Forward to"
+        # link to the next trapping is known, or at the end
+        file_contents_previous = template.render(context)
+        print(f"{moths_common.PREFIX}CREATED new directory '{dir_path}' and populated it with all"
               f" of the files for the trapping on {trapping['date'].strftime('%Y-%m-%d')}.")
 
         # Update the previous date and the previous file path
         # to be this one
-        date_previous = trapping['date']
+        date_previous_dmy = date_this_dmy
+        date_previous_long = date_this_long
         file_path_previous = file_path
 
+    # Write the last rendered HTML file, which has no "Forward to" link
+    if file_contents_previous is not None:
+        Path(file_path_previous).write_text(file_contents_previous)
+
     return len(trapping_list)
 
 def export_html(base_dir, base_url, site_name, db_config, jinja2_env, verbose=False):
@@ -422,34 +786,44 @@ def export_html(base_dir, base_url, site_name, db_config, jinja2_env, verbose=Fa
     """
     trappings_published = 0
 
-    # Check out the directories off base_url to determine the last trapping date
-    # already published there
-    last_published = url_trapping_latest(base_url, verbose)
-    if last_published:
-        # Fetch the last published trapping page to a local directory of the same
-        # name so that we can modify it
-        last_published_file_path = url_copy_local(base_dir, base_url, last_published, verbose)
-        if last_published_file_path:
-            # Get the date from the file path
-            last_published_date = date_from_path(str(last_published_file_path))
-            # Get a list of trappings from the database that are later than this date,
-            # each of which contains a dictionary of the fields that we need to
-            # make the HTML page
-            trapping_list = trappings_db_get_data(base_url, last_published_date, db_config, verbose)
-            if len(trapping_list) > 0:
-                # Create the HTML files for each trapping and modify the
-                # last published file to include them in the navigation sequence
-                trappings_published = trappings_publish(base_dir, base_url, site_name,
-                                                        last_published_file_path, trapping_list,
-                                                        jinja2_env, verbose)
-                if trappings_published > 0:
-                    print(f"{moths_common.PREFIX}finished.")
-                    print(f"{moths_common.PREFIX}please FTP the newly create HTML folder(s),"
-                          f" plus the updated file {str(last_published_file_path)}"
-                          f" (i.e. everything from {base_dir} if it was empty beforehand),"
-                          f" to {base_url[:-1]} and your published moth data will be up to date.")
-                    print(f"{moths_common.PREFIX}you may modify the FTP'ed HTML files, they will"
-                           " not be modified by this program in future runs once uploaded.")
+    # All of the URLs are built by appending to base_url
+    if not base_url.endswith('/'):
+        print(f"{moths_common.PREFIX}ERROR: the base URL '{base_url}' must end with a '/'.")
+        return -1
+
+    # One HTTP pool manager for all of the fetches from base_url, so that
+    # the connection is kept alive between them
+    last_published_file_path = None
+    with http_session() as session:
+        # Check out the directories off base_url to determine the last trapping date
+        # already published there
+        last_published = url_trapping_latest(session, base_url, verbose)
+        if last_published:
+            # Fetch the last published trapping page to a local directory of the same
+            # name so that we can modify it
+            last_published_file_path = url_copy_local(session, base_dir, base_url,
+                                                      last_published, verbose)
+    if last_published_file_path:
+        # Get the date from the file path
+        last_published_date = date_from_path(str(last_published_file_path))
+        # Get a list of trappings from the database that are later than this date,
+        # each of which contains a dictionary of the fields that we need to
+        # make the HTML page
+        trapping_list = trappings_db_get_data(base_url, last_published_date, db_config, verbose)
+        if len(trapping_list) > 0:
+            # Create the HTML files for each trapping and modify the
+            # last published file to include them in the navigation sequence
+            trappings_published = trappings_publish(base_dir, base_url, site_name,
+                                                    last_published_file_path, trapping_list,
+                                                    db_config, jinja2_env, verbose)
+            if trappings_published > 0:
+                print(f"{moths_common.PREFIX}finished.")
+                print(f"{moths_common.PREFIX}please FTP the newly create HTML folder(s),"
+                      f" plus the updated file {str(last_published_file_path)}"
+                      f" (i.e. everything from {base_dir} if it was empty beforehand),"
+                      f" to {base_url[:-1]} and your published moth data will be up to date.")
+                print(f"{moths_common.PREFIX}you may modify the FTP'ed HTML files, they will"
+                       " not be modified by this program in future runs once uploaded.")
 
     return trappings_published
 
@@ -489,11 +863,17 @@ if __name__ == '__main__':
         'database': args.d
     }
 
-    # The Jinja2 environment
+    # The Jinja2 environment, with the compiled template cached
+    # on disk so that it is not compiled afresh on every run
+    Path(JINJA2_CACHE_DIR).mkdir(parents=True, exist_ok=True)
     jinja2_env = Environment (
         loader = FileSystemLoader("templates"),
-        autoescape = select_autoescape()
+        autoescape = select_autoescape(),
+        bytecode_cache = FileSystemBytecodeCache(JINJA2_CACHE_DIR)
     )
 
+    # Get the MySQL credentials before starting work
+    moths_common.ensure_credentials(db_config)
+
     # Return 0 on success (i.e. something was exported), else 1
     sys.exit(not (export_html(args.base_dir, args.u, args.n, db_config, jinja2_env, args.v) >= 0))
\ No newline at end of file
@@ -17,7 +17,11 @@
 import sys
 import os
 import argparse
+import re
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import mysql.connector
 from mysql.connector import Error
 
@@ -26,49 +30,109 @@ import moths_common
 # The default maximum size for an image (use 0 for no limit)
 IMAGE_SIZE_MAX_DEFAULT = (1024 * 1024)
 
-def ensure_trapping(db_config, date, verbose=False):
+# The file name extensions, in lower case, of the images to be imported
+JPG_SUFFIXES = ('.jpg', '.jpeg')
+
+# Regex to pick apart an image file name, without the .jpg, of the form
+# blah_n or blah_n_m, where n is an integer count and m is a single letter
+IMAGE_FILE_NAME_REGEX = re.compile('(?P<blah>.+?)_(?P<n>\\d+)(?:_(?P<m>[a-z]))?', flags=re.IGNORECASE)
+
+# The maximum number of bytes of image data sent to the instance table
+# in one multi-row INSERT; the limit actually used may be lower, since
+# the whole INSERT must also fit within the server's max_allowed_packet
+INSTANCE_INSERT_BATCH_SIZE_MAX = (16 * 1024 * 1024)
+
+# The number of bytes of max_allowed_packet kept back for the parts of
+# a multi-row INSERT other than the image data
+INSTANCE_INSERT_PACKET_MARGIN = (64 * 1024)
+
+# The number of date directories that are imported at the same time,
+# each needing a connection from the pool
+IMPORT_DIRECTORY_WORKERS = moths_common.CONNECTION_POOL_SIZE
+
+# The number of image files that are read from disk ahead of them
+# being sent to the database
+IMAGE_READ_AHEAD = 4
+
+def files_read(file_list, read_ahead=IMAGE_READ_AHEAD):
+    """
+    Generator that yields the contents of the 'file_path' of each entry in
+    file_list, in order, the files being read in the background up to
+    read_ahead files ahead of the one that was last yielded.
+    """
+    with ThreadPoolExecutor(max_workers=read_ahead) as executor:
+        futures = deque()
+        for file in file_list:
+            futures.append(executor.submit(Path(file['file_path']).read_bytes))
+            if len(futures) > read_ahead:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+def ensure_trapping(connection, date, verbose=False):
     """
     Add a row to the trapping table in the database, if a row with
     that date does not already exist, returning the ID of the row
-    or negative error code.
+    or negative error code; the caller commits the transaction.
     """
     return_value = -1
+    date_str = date.strftime('%Y-%m-%d')
     try:
+        # Newline included in each print, see add_instance_list()
         if verbose:
-            print(f"{moths_common.PREFIX}updating table {moths_common.TABLE_NAME_TRAPPING}...")
-        with moths_common.DatabaseConnection(**db_config) as connection:
-            cursor = connection.cursor()
-            date_str = date.strftime('%Y-%m-%d')
+            print((f"{moths_common.PREFIX}updating table {moths_common.TABLE_NAME_TRAPPING}"
+                   f" for date {date_str}...\n"), end='')
+        cursor = connection.cursor()
 
-            # SQL query to insert data if not already present
-            query = f"""
-            INSERT INTO {moths_common.TABLE_NAME_TRAPPING} (date)
-            VALUES (%s)
-            ON DUPLICATE KEY UPDATE date = date  -- Dummy update
-            """
-            cursor.execute(query, (date_str,))
+        # SQL query to insert data if not already present; the dummy
+        # update sets LAST_INSERT_ID() to the ID of any existing row,
+        # so that lastrowid is the ID of the row whether it was
+        # inserted or not, without having to SELECT it afterwards
+        query = f"""
+        INSERT INTO {moths_common.TABLE_NAME_TRAPPING} (date)
+        VALUES (%s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+        """
+        cursor.execute(query, (date_str,))
 
-            # Commit the transaction
-            connection.commit()
-
-           # Retrieve the ID of the existing or newly inserted row
-            cursor.execute(f"SELECT id FROM {moths_common.TABLE_NAME_TRAPPING} WHERE date = %s", (date_str,))
-            result = cursor.fetchone()
-            if result:
-                return_value = result[0]
-                print((f"{moths_common.PREFIX}trapping ID {return_value} in"
-                       f" {moths_common.TABLE_NAME_TRAPPING} table with date {date_str}."))
-            else:
-                print((f"{moths_common.PREFIX}ERROR: no row found in {moths_common.TABLE_NAME_TRAPPING}"
-                        " table after insert."))
+        # The ID of the existing or newly inserted row
+        if cursor.lastrowid:
+            return_value = cursor.lastrowid
+            print((f"{moths_common.PREFIX}trapping ID {return_value} in"
+                   f" {moths_common.TABLE_NAME_TRAPPING} table with date {date_str}.\n"), end='')
+        else:
+            print((f"{moths_common.PREFIX}ERROR: no row found in {moths_common.TABLE_NAME_TRAPPING}"
+                   f" table after insert for date {date_str}.\n"), end='')
     except Error as e:
-        print(f"{moths_common.PREFIX}ERROR inserting data: {e}.")
+        print(f"{moths_common.PREFIX}ERROR inserting data for date {date_str}: {e}.\n", end='')
     return return_value
 
-def add_instance_list(db_config, trapping_id, file_list, verbose=False):
+def instance_rows_insert(cursor, query, payload, payload_file_list):
     """
-    Add rows to the instance table in the database,
-    returning the number of rows added or negative error code.
+    Send the rows in payload, which came from the files in
+    payload_file_list, to the database in a single multi-row INSERT,
+    returning the number of rows added.
+    """
+    # The IDs given to the rows of a multi-row INSERT are
+    # consecutive, starting at lastrowid
+    cursor.executemany(query, payload)
+    # Report the whole batch with a single write, newlines
+    # included, so that the lines cannot be split up by those
+    # of another directory being imported at the same time;
+    # the same goes for all of the prints made during an import,
+    # each of which also names the date, since otherwise there
+    # would be no telling which directory a message refers to
+    print(''.join(f"{moths_common.PREFIX}  added {payload_file['file_path']} as entry ID"
+                  f" {cursor.lastrowid + offset} into {moths_common.TABLE_NAME_INSTANCE} table.\n"
+                  for offset, payload_file in enumerate(payload_file_list)), end='')
+    return len(payload)
+
+def add_instance_list(connection, trapping_id, date, file_list, verbose=False):
+    """
+    Add rows to the instance table in the database for the
+    trapping with the given ID and date, returning the number
+    of rows added or negative error code; the caller commits
+    the transaction.
     """
 
     # file_list is expected to be a list of objects containing the
@@ -76,55 +140,103 @@ def add_instance_list(db_config, trapping_id, file_list, verbose=False):
     # sorted in blah order
 
     return_value = -1
+    date_str = date.strftime('%Y-%m-%d')
     try:
         if verbose:
-            print(f"{moths_common.PREFIX}updating table {moths_common.TABLE_NAME_INSTANCE}...")
-        with moths_common.DatabaseConnection(**db_config) as connection:
-            cursor = connection.cursor()
-            return_value = 0
-            moth_count = 0
-            blah_previous = ''
-            for file in file_list:
-                # Get the count
-                count = file['n']
-                if file['blah'] == blah_previous:
-                    # If the prefix is the same as the previous
-                    # file we must be in a case where m is present,
-                    # i.e. this is an additional image of the same moth,
-                    # so ignore the count this time
-                    count = 0
-                blah_previous = file['blah']
-                # Read the image file as binary data
-                with open(file['file_path'], 'rb') as image_file:
-                    image_data = image_file.read()
+            print((f"{moths_common.PREFIX}updating table {moths_common.TABLE_NAME_INSTANCE}"
+                   f" for date {date_str}...\n"), end='')
+        cursor = connection.cursor()
+        return_value = 0
+        moth_count = 0
+        blah_previous = ''
+        # SQL query to insert data, the connector turning each
+        # executemany() of it into a single multi-row INSERT
+        query = f"""
+        INSERT INTO {moths_common.TABLE_NAME_INSTANCE} (count, image, trapping_id)
+        VALUES (%s, %s, %s)
+        """
+        # A batch of rows is sent before its image data would exceed
+        # the batch size limit, which is no more than half of the
+        # server's max_allowed_packet (less a margin), since escaping
+        # can double the size of the image data in the INSERT
+        cursor.execute('SELECT @@max_allowed_packet')
+        batch_size_max = min(INSTANCE_INSERT_BATCH_SIZE_MAX,
+                             (cursor.fetchone()[0] - INSTANCE_INSERT_PACKET_MARGIN) // 2)
+        # The rows waiting to be inserted, and the files they came from
+        payload = []
+        payload_file_list = []
+        payload_size = 0
+        # The image files are read in the background, so that reading
+        # the next ones overlaps with sending a batch to the database
+        for file, image_data in zip(file_list, files_read(file_list)):
+            if payload and payload_size + len(image_data) > batch_size_max:
+                return_value += instance_rows_insert(cursor, query, payload, payload_file_list)
+                payload = []
+                payload_file_list = []
+                payload_size = 0
+            # Get the count
+            count = file['n']
+            if file['blah'] == blah_previous:
+                # If the prefix is the same as the previous
+                # file we must be in a case where m is present,
+                # i.e. this is an additional image of the same moth,
+                # so ignore the count this time
+                count = 0
+            blah_previous = file['blah']
+            payload.append((str(count), image_data, trapping_id))
+            payload_file_list.append(file)
+            payload_size += len(image_data)
+            moth_count += count
+        if payload:
+            return_value += instance_rows_insert(cursor, query, payload, payload_file_list)
 
-                # SQL query to insert data
-                query = f"""
-                INSERT INTO {moths_common.TABLE_NAME_INSTANCE} (count, image, trapping_id)
-                VALUES (%s, %s, %s)
-                """
-                cursor.execute(query, (str(count), image_data, trapping_id))
+        print((f"{moths_common.PREFIX}{return_value} picture(s) added for date {date_str},"
+               f" representing {moth_count} moth(s).\n"), end='')
+    except Error as e:
+        print((f"{moths_common.PREFIX}ERROR inserting data for date {date_str}: '{e}', none of the"
+               f" {len(file_list)} image(s) have been added.\n"), end='')
+        return_value = -1
+    return return_value
 
-                # Commit the transaction
+def trapping_import(db_config, date, file_list, verbose=False):
+    """
+    Import the images in file_list as instances of a trapping on the
+    given date, as a single transaction on a single connection, so that
+    either all of them are added or, should anything fail, none of them
+    are, returning the number of images added or negative error code.
+    """
+    return_value = -1
+    try:
+        with moths_common.DatabaseConnection(**db_config) as connection:
+            # Make sure there is a row in the trapping table of the database for this date
+            return_value = ensure_trapping(connection, date, verbose)
+            if return_value >= 0:
+                # Add the images to the instance table in the database
+                return_value = add_instance_list(connection, return_value, date, file_list, verbose)
+            if return_value >= 0:
                 connection.commit()
-                print((f"{moths_common.PREFIX}  added {file['file_path']} as entry ID"
-                       f" {cursor.lastrowid} into {moths_common.TABLE_NAME_INSTANCE} table."))
-                moth_count += count
-                return_value += 1
-            print((f"{moths_common.PREFIX}{return_value} picture(s) added, representing"
-                   f" {moth_count} moth(s)."))
+            else:
+                connection.rollback()
     except Error as e:
-        print((f"{moths_common.PREFIX}ERROR inserting data: '{e}', only {return_value}"
-               f" of {len(file_list)} image(s) written."))
+        print(f"{moths_common.PREFIX}ERROR importing trapping for date {date.strftime('%Y-%m-%d')}: {e}.\n", end='')
+        return_value = -1
     return return_value
 
 def date_get(date_str):
     """
     Check if a string is a valid date in the format YYYY-MM-DD.
     """
+    # Most directory names can be ruled out on shape alone; for the
+    # rest the integers are picked out directly rather than with
+    # strptime(), which has to parse the format string each time
+    if len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return None
+    year, month, day = date_str[0:4], date_str[5:7], date_str[8:10]
+    if not (year + month + day).isdigit():
+        return None
     try:
-        # Attempt to parse the string into a datetime object
-        return datetime.strptime(date_str, '%Y-%m-%d')
+        # Attempt to make a datetime object, which checks the date is valid
+        return datetime(int(year), int(month), int(day))
     except ValueError:
         return None
 
@@ -133,110 +245,105 @@ def process_directory(base_dir, db_config, file_size_max=0, update_db=True, verb
     Iterate over sub-directories (each named with a date)
     """
     return_value = 0
+    # The date and file list of each directory that is to be imported
+    import_list = []
     print(f"{moths_common.PREFIX}searching directory '{base_dir}'.")
-    for date_dir in os.listdir(base_dir):
-        date_path = os.path.join(base_dir, date_dir)
+    # os.scandir() rather than os.listdir() since the entries it returns
+    # usually already know their type, saving a stat() call per entry
+    # for is_dir()
+    for date_entry in os.scandir(base_dir):
+        date_dir = date_entry.name
+        date_path = date_entry.path
 
         # Ensure it is a directory named in the form YYYY-MM-DD
         date = date_get(date_dir)
-        if date is not None and os.path.isdir(date_path):
+        if date is not None and date_entry.is_dir():
             print(f"{moths_common.PREFIX}processing sub-directory '{date_dir}'...")
-            # Iterate over the JPG files in the directory, making a list
+            # Iterate over the JPG files in the directory, grouping them by blah
             files_in_error = 0
-            file_list = []
-            for file_name in os.listdir(date_path):
-                if file_name.lower().endswith('.jpg'):
+            blah_dict = {}
+            for file_entry in os.scandir(date_path):
+                file_name = file_entry.name
+                # Only the extension is lower-cased for the comparison
+                file_name_no_ext, file_name_ext = os.path.splitext(file_name)
+                if file_name_ext.lower() in JPG_SUFFIXES:
+                    # Before we commit to the import, check the size of the file
+                    if file_size_max > 0 and file_entry.stat().st_size > file_size_max:
+                        print(f"{moths_common.PREFIX}ERROR: image '{file_entry.path}' is larger"
+                              f" than the limit that has been set ({file_size_max}); use"
+                               " the -s option to set a different limit if necessary.")
+                        files_in_error += 1
+                        continue
                     file_list_entry = {}
-                    file_list_entry['file_path'] = os.path.join(date_path, file_name)
+                    file_list_entry['file_path'] = file_entry.path
                     # The file name should either be blah_n.jpg, where n
                     # is an integer, or blah_n_m.jpg, where m is 'a', 'b', etc.
-                    # Split the filename at underscores and work backwards along it
-                    file_name_no_ext = file_name[:-4]
-                    file_name_parts = file_name_no_ext.split('_')
-                    len_prefix = len(file_name_no_ext);
-                    for text in reversed(file_name_parts):
-                        # First time around we either have m or n,
-                        # second time around we can only have n
-                        try:
-                            file_list_entry['n'] = int(text)
-                            # If we can convert it to an integer, we're done,
-                            # we have our n
-                            len_prefix -= len(text) + 1 # +1 for the underscore
-                            break;
-                        except ValueError:
-                            # It wasn't an integer (i.e. an n) so see if it is
-                            # a single letter, an m
-                            if 'm' not in file_list_entry and len(text) == 1 and text.isalpha():
-                                file_list_entry['m'] = text.lower()
-                                len_prefix -= len(text) + 1 # +1 for the underscore
-                            else:
-                                # Don't understand the format of this file name
-                                break;
-                    if 'n' in file_list_entry:
-                        file_list_entry['blah'] = file_name_no_ext[:len_prefix]
-                        file_list.append(file_list_entry)
+                    match = IMAGE_FILE_NAME_REGEX.fullmatch(file_name_no_ext)
+                    if match:
+                        file_list_entry['blah'] = match['blah']
+                        file_list_entry['n'] = int(match['n'])
+                        if match['m']:
+                            file_list_entry['m'] = match['m'].lower()
+                        blah_dict.setdefault(file_list_entry['blah'], []).append(file_list_entry)
                     else:
                         print((f"{moths_common.PREFIX}ERROR: '{file_name}' does not include a count, maybe"
                                 " it is not of the form blah_n.jpg or blah_n_m.jpg?"))
                         files_in_error += 1
             if files_in_error == 0:
+                # Now have the component parts of each image file name, the file_path,
+                # n, m and blah, grouped by blah; make them into a list in order of blah,
+                # for which only the distinct blahs need to be sorted
+                file_list = [file for blah in sorted(blah_dict) for file in blah_dict[blah]]
                 if len(file_list) > 0:
-                    # Now have a list of the component parts of each image file name:
-                    # the file_path, n, m and blah; sort the list in order of blah
-                    file_list.sort(key=lambda x: x['blah'])
-                    # A final name check: run through this list and check that, where we have
-                    # a name of the form blah_n_m.jpg, for any given blah the n's match,
-                    # since we will treat only the first n of each to avoid double-counting
-                    n = -1
-                    blah = ''
-                    for file in file_list:
-                        if 'm' in file:
-                            if blah == file['blah']:
-                                if file['n'] is not n:
+                    # A final name check: check that, where we have a name of the form
+                    # blah_n_m.jpg, for any given blah the n's match, since we will
+                    # treat only the first n of each to avoid double-counting
+                    for blah, blah_file_list in blah_dict.items():
+                        file_first = None
+                        for file in blah_file_list:
+                            if 'm' in file:
+                                if file_first is None:
+                                    file_first = file
+                                elif file['n'] != file_first['n']:
                                     print((f"{moths_common.PREFIX}ERROR: inconsistent value for 'n' ("
-                                           f"'{blah}_{file['n']}_{file['m']}.jpg' after '{blah}_{n}_{file['m']}.jpg'),"
+                                           f"'{os.path.basename(file['file_path'])}' after"
+                                           f" '{os.path.basename(file_first['file_path'])}'),"
                                             " ignoring this directory."))
                                     files_in_error += 1
-                                    break;
-                            else:
-                                # A new instance of blah, capture n
-                                n = file['n']
-                            blah = file['blah']
-                    if files_in_error == 0 and file_size_max > 0:
-                        # Before we commit to the import, check the sizes of each of the files
-                        for file in file_list:
-                            if os.path.getsize(file['file_path']) > file_size_max:
-                                print(f"{moths_common.PREFIX}ERROR: image '{file['file_path']}' is larger"
-                                      f" than the limit that has been set ({file_size_max}); use"
-                                       " the -s option to set a different limit if necessary.")
-                                files_in_error += 1
+                                    break
+                        if files_in_error > 0:
+                            break
                     if files_in_error == 0:
-                        # Make sure there is a row in the trapping table of the database for this date
                         if update_db:
-                            return_value = ensure_trapping(db_config, date, verbose)
+                            import_list.append((date, file_list))
                         else:
                             print((f"{moths_common.PREFIX}would have made sure that date '{date.strftime('%Y-%m-%d')}'"
                                    f" exists in the {moths_common.TABLE_NAME_TRAPPING} table."))
-                        if return_value >= 0:
-                            if update_db:
-                                # Add the images to the instance table in the database
-                                return_value = add_instance_list(db_config, return_value, file_list, verbose)
-                            else:
-                                print(f"{moths_common.PREFIX}would have added {len(file_list)} picture(s) to the instance table:")
-                                for file in file_list:
-                                    print(f"{moths_common.PREFIX}  {file['file_path']}: n={file['n']}", end='')
-                                    if 'm' in file:
-                                        print(f", m={file['m']}", end='')
-                                    print('')
+                            print(f"{moths_common.PREFIX}would have added {len(file_list)} picture(s) to the instance table:")
+                            for file in file_list:
+                                print(f"{moths_common.PREFIX}  {file['file_path']}: n={file['n']}", end='')
+                                if 'm' in file:
+                                    print(f", m={file['m']}", end='')
+                                print('')
                             return_value = len(file_list)
                 else:
                     if verbose:
                         print(f"{moths_common.PREFIX}warning: sub-directory '{date_dir}' contains no image files, ignoring.")
             else:
-                print(f"{moths_common.PREFIX}ERROR: sub-directory '{date_dir}' contains non-conformant .jpg files.")
+                print(f"{moths_common.PREFIX}ERROR: sub-directory '{date_dir}' contains files in error, ignoring it.")
         else:
             if verbose:
                 print(f"{moths_common.PREFIX}ignoring sub-directory '{date_dir}', likely because it is not of the form YYYY-MM-DD.")
+    if import_list:
+        # Each directory is imported as a separate trapping on its own
+        # connection, so they can be imported in parallel
+        with ThreadPoolExecutor(max_workers=min(len(import_list), IMPORT_DIRECTORY_WORKERS)) as executor:
+            futures = [executor.submit(trapping_import, db_config, date, file_list, verbose)
+                       for date, file_list in import_list]
+            # Any failure is what is returned, otherwise the last import
+            for future in futures:
+                if return_value >= 0:
+                    return_value = future.result()
     return return_value
 
 
@@ -287,5 +394,9 @@ if __name__ == '__main__':
         'database': args.d
     }
 
+    # Get the MySQL credentials before starting work
+    if not args.x:
+        moths_common.ensure_credentials(db_config)
+
     # Return 0 on success (i.e. something was imported), else 1
     sys.exit(not (process_directory(args.base_dir, db_config, int(args.s), not args.x, args.v) >= 0))
\ No newline at end of file